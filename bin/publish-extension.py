@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Chrome Web Store Auto-Publisher (Python Version)
-Uses official Google API libraries for more control and better error handling.
+Talks to the Chrome Web Store API directly for more control and better error handling.
 """
 
 import os
@@ -10,17 +10,55 @@ import json
 import argparse
 import zipfile
 import getpass
+import datetime
+import hashlib
+import mmap
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator
 
 try:
-    import requests
-    from google.auth.transport.requests import Request
-    from google.oauth2.credentials import Credentials
+    import fcntl
+except ImportError:  # Windows: cache still works, just without cross-process locking
+    fcntl = None
+
+try:
+    import orjson
+    _loads = orjson.loads
 except ImportError:
-    print("❌ Required packages not installed. Run:")
-    print("   pip install requests google-auth google-auth-oauthlib")
-    sys.exit(1)
+    _loads = json.loads
+
+TOKEN_CACHE_DIR = Path.home() / ".cache" / "eksi-arti"
+TOKEN_EXPIRY_MARGIN = 60  # seconds before expiry at which a cached token is considered stale
+
+# KEY=value pairs in .env.cws; comment and blank lines never match. Horizontal
+# whitespace only, so an empty value cannot swallow the following line.
+_ENV_RE = re.compile(r'^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*(.*?)[ \t\r]*$', re.M)
+
+def _import_requests():
+    """Import requests on first use so commands without HTTP (setup) start fast."""
+    try:
+        import requests
+    except ImportError:
+        print("❌ Required packages not installed. Run:")
+        print("   pip install requests")
+        print("   (optional, faster JSON parsing: pip install orjson)")
+        sys.exit(1)
+    return requests
+
+@contextmanager
+def _locked(lock_path: Path, exclusive: bool) -> Iterator[None]:
+    """Hold an advisory lock on lock_path for the duration of the block."""
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if fcntl:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
 
 class ChromeWebStorePublisher:
     def __init__(self, client_id: str, client_secret: str, refresh_token: str, extension_id: str):
@@ -29,14 +67,125 @@ class ChromeWebStorePublisher:
         self.refresh_token = refresh_token
         self.extension_id = extension_id
         self.access_token: Optional[str] = None
+        self.token_from_cache = False
         
         # Chrome Web Store API endpoints
         self.base_url = "https://www.googleapis.com/chromewebstore/v1.1"
         self.upload_url = f"https://www.googleapis.com/upload/chromewebstore/v1.1/items/{extension_id}"
         self.publish_url = f"{self.base_url}/items/{extension_id}/publish"
         
+        # Access tokens are cached between runs, keyed by the credentials that
+        # minted them so re-running setup with new ones invalidates the cache
+        cache_key = hashlib.sha256(f"{client_id}{refresh_token}{extension_id}".encode()).hexdigest()[:16]
+        self.token_cache_file = TOKEN_CACHE_DIR / f"cws-token-{cache_key}.json"
+        
+        requests = _import_requests()
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
+        # Shared session so keep-alive connections are reused across the
+        # token refresh -> upload -> publish chain. Transient failures are
+        # retried with exponential backoff; urllib3 rewinds the streamed ZIP
+        # body before each replay, so a retry never needs a fresh run.
+        retry = Retry(
+            total=5,
+            backoff_factor=1.0,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(['GET', 'POST', 'PUT']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+        self.session.headers.update({'x-goog-api-version': '2'})
+    
+    def __enter__(self) -> 'ChromeWebStorePublisher':
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        """Close the underlying HTTP session."""
+        self.session.close()
+        
+    def _load_cached_token(self) -> bool:
+        """Load a still-valid access token from the on-disk cache."""
+        if not self.token_cache_file.exists():
+            return False
+        
+        try:
+            with _locked(self.token_cache_file.with_suffix('.lock'), exclusive=False):
+                cached = _loads(self.token_cache_file.read_bytes())
+        except (OSError, ValueError):
+            return False
+        
+        if not isinstance(cached, dict):
+            return False
+        
+        access_token = cached.get('access_token')
+        expires_at = cached.get('expires_at')
+        if not isinstance(access_token, str) or not isinstance(expires_at, (int, float)):
+            return False
+        
+        if access_token and expires_at - time.time() > TOKEN_EXPIRY_MARGIN:
+            self._set_access_token(access_token, from_cache=True)
+            print("✅ Using cached access token")
+            return True
+        return False
+    
+    def _save_cached_token(self, expires_in: int) -> None:
+        """Atomically write the current access token to the on-disk cache."""
+        payload = {'access_token': self.access_token, 'expires_at': time.time() + expires_in}
+        tmp_file = self.token_cache_file.with_suffix('.tmp')
+        
+        try:
+            TOKEN_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with _locked(self.token_cache_file.with_suffix('.lock'), exclusive=True):
+                fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(payload, f)
+                os.replace(tmp_file, self.token_cache_file)
+        except OSError as e:
+            print(f"⚠️  Could not cache access token: {e}")
+    
+    def _clear_cached_token(self) -> None:
+        """Remove the on-disk access token so the next run refreshes it."""
+        try:
+            with _locked(self.token_cache_file.with_suffix('.lock'), exclusive=True):
+                self.token_cache_file.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"⚠️  Could not clear cached access token: {e}")
+    
+    def _set_access_token(self, access_token: str, from_cache: bool = False) -> None:
+        """Store the access token and attach it to every subsequent session request."""
+        self.access_token = access_token
+        self.token_from_cache = from_cache
+        self.session.headers['Authorization'] = f'Bearer {access_token}'
+    
+    def _ensure_access_token(self) -> bool:
+        """Make sure an access token is available, preferring the cache over a refresh."""
+        return bool(self.access_token) or self._load_cached_token() or self._refresh_access_token()
+    
+    def _request(self, method: str, url: str, **kwargs):
+        """Send an API request, refreshing once if a cached access token is rejected."""
+        response = self.session.request(method, url, **kwargs)
+        
+        if response.status_code == 401 and self.token_from_cache:
+            print("⚠️  Cached access token was rejected")
+            self._clear_cached_token()
+            if self._refresh_access_token():
+                body = kwargs.get('data')
+                if hasattr(body, 'seek'):
+                    body.seek(0)
+                response = self.session.request(method, url, **kwargs)
+        
+        return response
+    
     def _refresh_access_token(self) -> bool:
         """Refresh the OAuth access token using the refresh token."""
+        requests = _import_requests()
+        
         print("🔑 Refreshing access token...")
         
         token_url = "https://oauth2.googleapis.com/token"
@@ -48,50 +197,52 @@ class ChromeWebStorePublisher:
         }
         
         try:
-            response = requests.post(token_url, data=data)
+            # Don't send a possibly stale bearer token to the token endpoint
+            response = self.session.post(token_url, data=data, headers={'Authorization': None})
             response.raise_for_status()
             
-            token_data = response.json()
-            self.access_token = token_data.get('access_token')
+            token_data = _loads(response.content)
+            access_token = token_data.get('access_token')
             
-            if self.access_token:
+            if access_token:
+                self._set_access_token(access_token)
                 print("✅ Access token refreshed successfully")
+                self._save_cached_token(int(token_data.get('expires_in', 3600)))
                 return True
             else:
                 print("❌ Failed to get access token from response")
                 return False
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"❌ Error refreshing token: {e}")
             return False
     
-    def _get_headers(self) -> Dict[str, str]:
-        """Get HTTP headers with authorization."""
-        return {
-            'Authorization': f'Bearer {self.access_token}',
-            'x-goog-api-version': '2'
-        }
-    
     def upload_extension(self, zip_path: Path) -> bool:
         """Upload extension ZIP file to Chrome Web Store."""
-        if not self.access_token and not self._refresh_access_token():
+        if not self._ensure_access_token():
             return False
             
         print(f"📤 Uploading {zip_path.name} to Chrome Web Store...")
         
         try:
-            with open(zip_path, 'rb') as zip_file:
-                headers = self._get_headers()
-                headers['Content-Type'] = 'application/zip'
+            # Memory-map the package so the body is streamed straight from the
+            # page cache rather than read into a bytes object first
+            with open(zip_path, 'rb') as zip_file, \
+                    mmap.mmap(zip_file.fileno(), 0, access=mmap.ACCESS_READ) as zip_data:
+                headers = {
+                    'Content-Type': 'application/zip',
+                    'Content-Length': str(len(zip_data))
+                }
                 
-                response = requests.put(
+                response = self._request(
+                    'PUT',
                     self.upload_url,
                     headers=headers,
-                    data=zip_file.read()
+                    data=zip_data
                 )
                 
                 if response.status_code == 200:
-                    result = response.json()
+                    result = _loads(response.content)
                     if result.get('uploadState') == 'SUCCESS':
                         print("✅ Extension uploaded successfully")
                         return True
@@ -108,27 +259,27 @@ class ChromeWebStorePublisher:
     
     def publish_extension(self, target: str = 'default') -> bool:
         """Publish the extension."""
-        if not self.access_token and not self._refresh_access_token():
+        if not self._ensure_access_token():
             return False
             
         print(f"🚀 Publishing extension (target: {target})...")
         
         try:
-            headers = self._get_headers()
-            headers['Content-Length'] = '0'
+            headers = {'Content-Length': '0'}
             
             params = {}
             if target == 'testers':
                 params['publishTarget'] = 'trustedTesters'
             
-            response = requests.post(
+            response = self._request(
+                'POST',
                 self.publish_url,
                 headers=headers,
                 params=params
             )
             
             if response.status_code == 200:
-                result = response.json()
+                result = _loads(response.content)
                 status = result.get('status', [])
                 
                 if 'OK' in status:
@@ -147,17 +298,17 @@ class ChromeWebStorePublisher:
     
     def get_extension_info(self) -> Optional[Dict[str, Any]]:
         """Get information about the extension."""
-        if not self.access_token and not self._refresh_access_token():
+        if not self._ensure_access_token():
             return None
             
         print("ℹ️  Fetching extension information...")
         
         try:
             url = f"{self.base_url}/items/{self.extension_id}?projection=DRAFT"
-            response = requests.get(url, headers=self._get_headers())
+            response = self._request('GET', url)
             
             if response.status_code == 200:
-                return response.json()
+                return _loads(response.content)
             else:
                 print(f"❌ HTTP Error {response.status_code}: {response.text}")
                 return None
@@ -177,10 +328,9 @@ def get_project_info() -> tuple[Path, str]:
         sys.exit(1)
     
     try:
-        with open(package_json) as f:
-            pkg_data = json.load(f)
-            version = pkg_data.get('version', '1.0.0')
-            return project_root, version
+        pkg_data = _loads(package_json.read_bytes())
+        version = pkg_data.get('version', '1.0.0')
+        return project_root, version
     except Exception as e:
         print(f"❌ Error reading package.json: {e}")
         sys.exit(1)
@@ -197,6 +347,18 @@ def find_extension_zip(project_root: Path, version: str) -> Path:
     
     return zip_file
 
+def check_extension_zip(zip_path: Path) -> Optional[str]:
+    """Cheaply check the package is a readable ZIP; return an error message if not."""
+    try:
+        zip_path.stat()
+    except OSError as e:
+        return f"Cannot read extension package: {e}"
+    
+    # Only reads the end-of-central-directory record, not the members
+    if not zipfile.is_zipfile(zip_path):
+        return f"Extension package is not a valid ZIP file: {zip_path}"
+    return None
+
 def load_env_file() -> bool:
     """Load environment variables from .env.cws file."""
     script_dir = Path(__file__).parent
@@ -206,12 +368,7 @@ def load_env_file() -> bool:
     if env_file.exists():
         print("ℹ️  Loading credentials from .env.cws file...")
         try:
-            with open(env_file) as f:
-                for line in f:
-                    line = line.strip()
-                    if line and not line.startswith('#') and '=' in line:
-                        key, value = line.split('=', 1)
-                        os.environ[key.strip()] = value.strip()
+            os.environ.update(_ENV_RE.findall(env_file.read_text()))
             return True
         except Exception as e:
             print(f"❌ Error loading .env.cws file: {e}")
@@ -230,14 +387,8 @@ def get_env_vars() -> tuple[str, str, str, str]:
         'CWS_EXTENSION_ID'
     ]
     
-    missing_vars = []
-    values = []
-    
-    for var in required_vars:
-        value = os.getenv(var)
-        if not value:
-            missing_vars.append(var)
-        values.append(value or "")
+    env = {var: os.environ.get(var, '') for var in required_vars}
+    missing_vars = [var for var, value in env.items() if not value]
     
     if missing_vars:
         print("❌ Missing required credentials:")
@@ -247,7 +398,7 @@ def get_env_vars() -> tuple[str, str, str, str]:
         print(f"ℹ️  Or see help: python {__file__} --help")
         sys.exit(1)
     
-    return tuple(values)
+    return tuple(env.values())
 
 def print_setup_guide():
     """Print detailed setup instructions."""
@@ -331,7 +482,7 @@ def run_setup_wizard():
     try:
         with open(env_file, 'w') as f:
             f.write("# Chrome Web Store API Credentials\n")
-            f.write(f"# Generated by setup wizard on {os.popen('date').read().strip()}\n")
+            f.write(f"# Generated by setup wizard on {datetime.datetime.now().isoformat(timespec='seconds')}\n")
             f.write("# Do not commit this file to version control!\n")
             f.write("\n")
             f.write(f"CWS_CLIENT_ID={client_id}\n")
@@ -416,38 +567,51 @@ Setup Guide:
         zip_path = find_extension_zip(project_root, version)
     
     # Create publisher
-    publisher = ChromeWebStorePublisher(client_id, client_secret, refresh_token, extension_id)
-    
-    print(f"🎯 Extension ID: {extension_id}")
-    print(f"📦 Package: {zip_path.name}")
-    print(f"🔢 Version: {version}")
-    print()
-    
-    # Execute action
-    if args.action == 'info':
-        info = publisher.get_extension_info()
-        if info:
-            print(f"📊 Extension: {info.get('title', 'Unknown')}")
-            print(f"📈 Status: {info.get('status', 'Unknown')}")
-            print(f"🔢 Version: {info.get('version', 'Unknown')}")
+    with ChromeWebStorePublisher(client_id, client_secret, refresh_token, extension_id) as publisher:
+        print(f"🎯 Extension ID: {extension_id}")
+        print(f"📦 Package: {zip_path.name}")
+        print(f"🔢 Version: {version}")
+        print()
         
-    elif args.action == 'upload':
-        if publisher.upload_extension(zip_path):
-            print("🎉 Extension uploaded successfully! Visit Chrome Web Store Developer Console to publish manually.")
-        else:
-            sys.exit(1)
+        # Warm up the access token while the package is checked locally, so
+        # the upload and publish calls start without any auth round-trip
+        if args.action != 'info':
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                token_future = executor.submit(publisher._ensure_access_token)
+                zip_future = executor.submit(check_extension_zip, zip_path)
+                zip_error = zip_future.result()
+                has_token = token_future.result()
             
-    elif args.action == 'publish':
-        if publisher.upload_extension(zip_path) and publisher.publish_extension():
-            print("🎉 Extension uploaded and submitted for review!")
-        else:
-            sys.exit(1)
+            if zip_error:
+                print(f"❌ {zip_error}")
+            if zip_error or not has_token:
+                sys.exit(1)
+    
+        # Execute action
+        if args.action == 'info':
+            info = publisher.get_extension_info()
+            if info:
+                print(f"📊 Extension: {info.get('title', 'Unknown')}")
+                print(f"📈 Status: {info.get('status', 'Unknown')}")
+                print(f"🔢 Version: {info.get('version', 'Unknown')}")
+        
+        elif args.action == 'upload':
+            if publisher.upload_extension(zip_path):
+                print("🎉 Extension uploaded successfully! Visit Chrome Web Store Developer Console to publish manually.")
+            else:
+                sys.exit(1)
             
-    elif args.action == 'testers':
-        if publisher.upload_extension(zip_path) and publisher.publish_extension('testers'):
-            print("🎉 Extension uploaded and submitted for testers review!")
-        else:
-            sys.exit(1)
+        elif args.action == 'publish':
+            if publisher.upload_extension(zip_path) and publisher.publish_extension():
+                print("🎉 Extension uploaded and submitted for review!")
+            else:
+                sys.exit(1)
+            
+        elif args.action == 'testers':
+            if publisher.upload_extension(zip_path) and publisher.publish_extension('testers'):
+                print("🎉 Extension uploaded and submitted for testers review!")
+            else:
+                sys.exit(1)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file